@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 from base_bert import BertPreTrainedModel
 from utils import *
 
@@ -153,6 +154,8 @@ class BertModel(BertPreTrainedModel):
 
     # BERT encoder.
     self.bert_layers = nn.ModuleList([BertLayer(config) for _ in range(config.num_hidden_layers)])
+    # When enabled, encoder activations are recomputed during backward instead of stored.
+    self.gradient_checkpointing = False
 
     # [CLS] token transformations.
     self.pooler_dense = nn.Linear(config.hidden_size, config.hidden_size)
@@ -160,7 +163,7 @@ class BertModel(BertPreTrainedModel):
 
     self.init_weights()
 
-  def embed(self, input_ids):
+  def embed(self, input_ids, token_type_ids=None):
     input_shape = input_ids.size()
     seq_length = input_shape[1]
 
@@ -173,10 +176,11 @@ class BertModel(BertPreTrainedModel):
     pos_embeds = self.pos_embedding(pos_ids)
 
 
-    # Get token type ids. Since we are not considering token type, this embedding is
-    # just a placeholder.
-    tk_type_ids = torch.zeros(input_shape, dtype=torch.long, device=input_ids.device)
-    tk_type_embeds = self.tk_type_embedding(tk_type_ids)
+    # Get the token type embedding. For single-sentence inputs the caller passes no
+    # token_type_ids and all tokens belong to segment 0.
+    if token_type_ids is None:
+      token_type_ids = torch.zeros(input_shape, dtype=torch.long, device=input_ids.device)
+    tk_type_embeds = self.tk_type_embedding(token_type_ids)
 
     # Add three embeddings together; then apply embed_layer_norm and dropout and return.
     embeds = self.embed_layer_norm(inputs_embeds + pos_embeds + tk_type_embeds)
@@ -198,17 +202,29 @@ class BertModel(BertPreTrainedModel):
     # Pass the hidden states through the encoder layers.
     for i, layer_module in enumerate(self.bert_layers):
       # Feed the encoding from the last bert_layer to the next.
-      hidden_states = layer_module(hidden_states, extended_attention_mask)
+      if self.gradient_checkpointing and self.training:
+        # Trade ~20-30% recompute in backward for not storing per-layer activations.
+        hidden_states = checkpoint(layer_module, hidden_states, extended_attention_mask,
+                                   use_reentrant=False)
+      else:
+        hidden_states = layer_module(hidden_states, extended_attention_mask)
 
     return hidden_states
 
-  def forward(self, input_ids, attention_mask):
+  def gradient_checkpointing_enable(self):
+    self.gradient_checkpointing = True
+
+  def gradient_checkpointing_disable(self):
+    self.gradient_checkpointing = False
+
+  def forward(self, input_ids, attention_mask, token_type_ids=None):
     """
     input_ids: [batch_size, seq_len], seq_len is the max length of the batch
     attention_mask: same size as input_ids, 1 represents non-padding tokens, 0 represents padding tokens
+    token_type_ids: same size as input_ids, segment id of each token (optional; defaults to all zeros)
     """
     # Get the embedding for each input token.
-    embedding_output = self.embed(input_ids=input_ids)
+    embedding_output = self.embed(input_ids=input_ids, token_type_ids=token_type_ids)
 
     # Feed to a transformer (a stack of BertLayers).
     sequence_output = self.encode(embedding_output, attention_mask=attention_mask)
@@ -9,9 +9,10 @@ examples are preprocessed.
 '''
 
 import csv
+import random
 
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from tokenizer import BertTokenizer
 
 
@@ -24,27 +25,84 @@ def preprocess_string(s):
                     .split())
 
 
+def pad_token_ids(seqs, pad_id, pad_to_multiple=None):
+    '''Pad a batch of variable-length token id lists to the batch max length.
+    Returns the padded LongTensor and the matching attention mask.
+
+    When pad_to_multiple is set, the padded length is rounded up to the next
+    multiple of it. That bounds the set of batch shapes (at most 512/multiple of
+    them), which lets torch.compile's CUDA-graph replay reuse captured graphs
+    instead of recapturing for every new length, and keeps matmul dimensions
+    tensor-core friendly.
+    '''
+    max_len = max(len(seq) for seq in seqs)
+    if pad_to_multiple is not None and pad_to_multiple > 1:
+        max_len = -(-max_len // pad_to_multiple) * pad_to_multiple
+    token_ids = torch.full((len(seqs), max_len), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros(len(seqs), max_len, dtype=torch.long)
+    for i, seq in enumerate(seqs):
+        token_ids[i, :len(seq)] = torch.tensor(seq, dtype=torch.long)
+        attention_mask[i, :len(seq)] = 1
+    return token_ids, attention_mask
+
+
+class BucketBatchSampler(Sampler):
+    '''Yields batches of indices grouped by approximate sequence length, so each
+    batch pads to the length of its longest member rather than the corpus max.
+
+    Shuffling happens at two levels to keep batches stochastic: example order is
+    shuffled before grouping neighbours into megabatches of
+    batch_size * bucket_factor examples (which are then sorted by length and cut
+    into batches), and the resulting batches are shuffled again.
+    '''
+    def __init__(self, lengths, batch_size, shuffle=True, bucket_factor=50):
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.megabatch_size = batch_size * bucket_factor
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            random.shuffle(indices)
+        batches = []
+        for start in range(0, len(indices), self.megabatch_size):
+            megabatch = indices[start:start + self.megabatch_size]
+            megabatch.sort(key=lambda i: self.lengths[i])
+            for j in range(0, len(megabatch), self.batch_size):
+                batches.append(megabatch[j:j + self.batch_size])
+        if self.shuffle:
+            random.shuffle(batches)
+        return iter(batches)
+
+
 class SentenceClassificationDataset(Dataset):
     def __init__(self, dataset, args):
         self.dataset = dataset
         self.p = args
         self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+        # Tokenize the whole split once up front; collate_fn then only gathers and
+        # pads, so every epoch after the first pays no tokenization cost.
+        self.token_ids = self.tokenizer([x[0] for x in dataset], truncation=True)['input_ids']
 
     def __len__(self):
         return len(self.dataset)
 
     def __getitem__(self, idx):
-        return self.dataset[idx]
+        return idx
 
-    def pad_data(self, data):
+    def pad_data(self, indices):
 
-        sents = [x[0] for x in data]
-        labels = [x[1] for x in data]
-        sent_ids = [x[2] for x in data]
+        sents = [self.dataset[i][0] for i in indices]
+        labels = [self.dataset[i][1] for i in indices]
+        sent_ids = [self.dataset[i][2] for i in indices]
 
-        encoding = self.tokenizer(sents, return_tensors='pt', padding=True, truncation=True)
-        token_ids = torch.LongTensor(encoding['input_ids'])
-        attention_mask = torch.LongTensor(encoding['attention_mask'])
+        token_ids, attention_mask = pad_token_ids([self.token_ids[i] for i in indices],
+                                                  self.tokenizer.pad_token_id,
+                                                  pad_to_multiple=getattr(self.p, 'pad_multiple', None))
         labels = torch.LongTensor(labels)
 
         return token_ids, attention_mask, labels, sents, sent_ids
@@ -69,20 +127,21 @@ class SentenceClassificationTestDataset(Dataset):
         self.dataset = dataset
         self.p = args
         self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+        self.token_ids = self.tokenizer([x[0] for x in dataset], truncation=True)['input_ids']
 
     def __len__(self):
         return len(self.dataset)
 
     def __getitem__(self, idx):
-        return self.dataset[idx]
+        return idx
 
-    def pad_data(self, data):
-        sents = [x[0] for x in data]
-        sent_ids = [x[1] for x in data]
+    def pad_data(self, indices):
+        sents = [self.dataset[i][0] for i in indices]
+        sent_ids = [self.dataset[i][1] for i in indices]
 
-        encoding = self.tokenizer(sents, return_tensors='pt', padding=True, truncation=True)
-        token_ids = torch.LongTensor(encoding['input_ids'])
-        attention_mask = torch.LongTensor(encoding['attention_mask'])
+        token_ids, attention_mask = pad_token_ids([self.token_ids[i] for i in indices],
+                                                  self.tokenizer.pad_token_id,
+                                                  pad_to_multiple=getattr(self.p, 'pad_multiple', None))
 
         return token_ids, attention_mask, sents, sent_ids
 
@@ -100,34 +159,65 @@ class SentenceClassificationTestDataset(Dataset):
 
 
 class SentencePairDataset(Dataset):
-    def __init__(self, dataset, args, isRegression=False):
+    def __init__(self, dataset, args, isRegression=False, joint=False):
         self.dataset = dataset
         self.p = args
-        self.isRegression = isRegression 
+        self.isRegression = isRegression
+        # Joint mode tokenizes each pair as one `[CLS] s1 [SEP] s2 [SEP]` sequence
+        # with real segment ids, so a pair costs a single BERT forward.
+        self.joint = joint
         self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+        sent1 = [x[0] for x in dataset]
+        sent2 = [x[1] for x in dataset]
+        if joint:
+            encoding = self.tokenizer(sent1, sent2, truncation=True)
+            self.token_ids = encoding['input_ids']
+            self.token_type_ids = encoding['token_type_ids']
+        else:
+            encoding1 = self.tokenizer(sent1, truncation=True)
+            encoding2 = self.tokenizer(sent2, truncation=True)
+            self.token_ids = encoding1['input_ids']
+            self.token_type_ids = encoding1['token_type_ids']
+            self.token_ids2 = encoding2['input_ids']
+            self.token_type_ids2 = encoding2['token_type_ids']
 
     def __len__(self):
         return len(self.dataset)
 
     def __getitem__(self, idx):
-        return self.dataset[idx]
+        return idx
+
+    def pad_data_joint(self, indices):
+        labels = [self.dataset[i][2] for i in indices]
+        sent_ids = [self.dataset[i][3] for i in indices]
+
+        token_ids, attention_mask = pad_token_ids([self.token_ids[i] for i in indices],
+                                                  self.tokenizer.pad_token_id,
+                                                  pad_to_multiple=getattr(self.p, 'pad_multiple', None))
+        token_type_ids, _ = pad_token_ids([self.token_type_ids[i] for i in indices], 0,
+                                      pad_to_multiple=getattr(self.p, 'pad_multiple', None))
+        if self.isRegression:
+            labels = torch.DoubleTensor(labels)
+        else:
+            labels = torch.LongTensor(labels)
 
-    def pad_data(self, data):
-        sent1 = [x[0] for x in data]
-        sent2 = [x[1] for x in data]
-        labels = [x[2] for x in data]
-        sent_ids = [x[3] for x in data]
+        return token_ids, token_type_ids, attention_mask, labels, sent_ids
 
-        encoding1 = self.tokenizer(sent1, return_tensors='pt', padding=True, truncation=True)
-        encoding2 = self.tokenizer(sent2, return_tensors='pt', padding=True, truncation=True)
+    def pad_data(self, indices):
+        labels = [self.dataset[i][2] for i in indices]
+        sent_ids = [self.dataset[i][3] for i in indices]
 
-        token_ids = torch.LongTensor(encoding1['input_ids'])
-        attention_mask = torch.LongTensor(encoding1['attention_mask'])
-        token_type_ids = torch.LongTensor(encoding1['token_type_ids'])
+        token_ids, attention_mask = pad_token_ids([self.token_ids[i] for i in indices],
+                                                  self.tokenizer.pad_token_id,
+                                                  pad_to_multiple=getattr(self.p, 'pad_multiple', None))
+        token_type_ids, _ = pad_token_ids([self.token_type_ids[i] for i in indices], 0,
+                                      pad_to_multiple=getattr(self.p, 'pad_multiple', None))
 
-        token_ids2 = torch.LongTensor(encoding2['input_ids'])
-        attention_mask2 = torch.LongTensor(encoding2['attention_mask'])
-        token_type_ids2 = torch.LongTensor(encoding2['token_type_ids'])
+        token_ids2, attention_mask2 = pad_token_ids([self.token_ids2[i] for i in indices],
+                                                    self.tokenizer.pad_token_id,
+                                                  pad_to_multiple=getattr(self.p, 'pad_multiple', None))
+        token_type_ids2, _ = pad_token_ids([self.token_type_ids2[i] for i in indices], 0,
+                                       pad_to_multiple=getattr(self.p, 'pad_multiple', None))
         if self.isRegression:
             labels = torch.DoubleTensor(labels)
         else:
@@ -138,6 +228,19 @@ class SentencePairDataset(Dataset):
                 labels,sent_ids)
 
     def collate_fn(self, all_data):
+        if self.joint:
+            token_ids, token_type_ids, attention_mask, labels, sent_ids = self.pad_data_joint(all_data)
+
+            batched_data = {
+                    'token_ids': token_ids,
+                    'token_type_ids': token_type_ids,
+                    'attention_mask': attention_mask,
+                    'labels': labels,
+                    'sent_ids': sent_ids
+                }
+
+            return batched_data
+
         (token_ids, token_type_ids, attention_mask,
          token_ids2, token_type_ids2, attention_mask2,
          labels, sent_ids) = self.pad_data(all_data)
@@ -158,32 +261,56 @@ class SentencePairDataset(Dataset):
 
 # Unlike SentencePairDataset, we do not load labels in SentencePairTestDataset.
 class SentencePairTestDataset(Dataset):
-    def __init__(self, dataset, args):
+    def __init__(self, dataset, args, joint=False):
         self.dataset = dataset
         self.p = args
+        self.joint = joint
         self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+        sent1 = [x[0] for x in dataset]
+        sent2 = [x[1] for x in dataset]
+        if joint:
+            encoding = self.tokenizer(sent1, sent2, truncation=True)
+            self.token_ids = encoding['input_ids']
+            self.token_type_ids = encoding['token_type_ids']
+        else:
+            encoding1 = self.tokenizer(sent1, truncation=True)
+            encoding2 = self.tokenizer(sent2, truncation=True)
+            self.token_ids = encoding1['input_ids']
+            self.token_type_ids = encoding1['token_type_ids']
+            self.token_ids2 = encoding2['input_ids']
+            self.token_type_ids2 = encoding2['token_type_ids']
 
     def __len__(self):
         return len(self.dataset)
 
     def __getitem__(self, idx):
-        return self.dataset[idx]
+        return idx
 
-    def pad_data(self, data):
-        sent1 = [x[0] for x in data]
-        sent2 = [x[1] for x in data]
-        sent_ids = [x[2] for x in data]
+    def pad_data_joint(self, indices):
+        sent_ids = [self.dataset[i][2] for i in indices]
 
-        encoding1 = self.tokenizer(sent1, return_tensors='pt', padding=True, truncation=True)
-        encoding2 = self.tokenizer(sent2, return_tensors='pt', padding=True, truncation=True)
+        token_ids, attention_mask = pad_token_ids([self.token_ids[i] for i in indices],
+                                                  self.tokenizer.pad_token_id,
+                                                  pad_to_multiple=getattr(self.p, 'pad_multiple', None))
+        token_type_ids, _ = pad_token_ids([self.token_type_ids[i] for i in indices], 0,
+                                      pad_to_multiple=getattr(self.p, 'pad_multiple', None))
 
-        token_ids = torch.LongTensor(encoding1['input_ids'])
-        attention_mask = torch.LongTensor(encoding1['attention_mask'])
-        token_type_ids = torch.LongTensor(encoding1['token_type_ids'])
+        return token_ids, token_type_ids, attention_mask, sent_ids
 
-        token_ids2 = torch.LongTensor(encoding2['input_ids'])
-        attention_mask2 = torch.LongTensor(encoding2['attention_mask'])
-        token_type_ids2 = torch.LongTensor(encoding2['token_type_ids'])
+    def pad_data(self, indices):
+        sent_ids = [self.dataset[i][2] for i in indices]
+
+        token_ids, attention_mask = pad_token_ids([self.token_ids[i] for i in indices],
+                                                  self.tokenizer.pad_token_id,
+                                                  pad_to_multiple=getattr(self.p, 'pad_multiple', None))
+        token_type_ids, _ = pad_token_ids([self.token_type_ids[i] for i in indices], 0,
+                                      pad_to_multiple=getattr(self.p, 'pad_multiple', None))
+
+        token_ids2, attention_mask2 = pad_token_ids([self.token_ids2[i] for i in indices],
+                                                    self.tokenizer.pad_token_id,
+                                                  pad_to_multiple=getattr(self.p, 'pad_multiple', None))
+        token_type_ids2, _ = pad_token_ids([self.token_type_ids2[i] for i in indices], 0,
+                                       pad_to_multiple=getattr(self.p, 'pad_multiple', None))
 
 
         return (token_ids, token_type_ids, attention_mask,
@@ -191,6 +318,18 @@ class SentencePairTestDataset(Dataset):
                sent_ids)
 
     def collate_fn(self, all_data):
+        if self.joint:
+            token_ids, token_type_ids, attention_mask, sent_ids = self.pad_data_joint(all_data)
+
+            batched_data = {
+                    'token_ids': token_ids,
+                    'token_type_ids': token_type_ids,
+                    'attention_mask': attention_mask,
+                    'sent_ids': sent_ids
+                }
+
+            return batched_data
+
         (token_ids, token_type_ids, attention_mask,
          token_ids2, token_type_ids2, attention_mask2,
          sent_ids) = self.pad_data(all_data)
@@ -135,6 +135,91 @@ def model_eval_multitask(sentiment_dataloader,
                 sts_corr, sts_y_pred, sts_sent_ids)
 
 
+# Evaluate multitask model on dev sets when the pair dataloaders use joint
+# tokenization (SentencePairDataset with joint=True), i.e. one
+# `[CLS] s1 [SEP] s2 [SEP]` sequence per pair.
+def model_eval_multitask_joint(sentiment_dataloader,
+                               paraphrase_dataloader,
+                               sts_dataloader,
+                               model, device):
+    model.eval()  # Switch to eval model, will turn off randomness like dropout.
+
+    with torch.no_grad():
+        # Evaluate sentiment classification.
+        sst_y_true = []
+        sst_y_pred = []
+        sst_sent_ids = []
+        for step, batch in enumerate(tqdm(sentiment_dataloader, desc=f'eval', disable=TQDM_DISABLE)):
+            b_ids, b_mask, b_labels, b_sent_ids = batch['token_ids'], batch['attention_mask'], batch['labels'], batch['sent_ids']
+
+            b_ids = b_ids.to(device)
+            b_mask = b_mask.to(device)
+
+            logits = model.predict_sentiment(b_ids, b_mask)
+            y_hat = logits.argmax(dim=-1).flatten().cpu().numpy()
+            b_labels = b_labels.flatten().cpu().numpy()
+
+            sst_y_pred.extend(y_hat)
+            sst_y_true.extend(b_labels)
+            sst_sent_ids.extend(b_sent_ids)
+
+        sentiment_accuracy = np.mean(np.array(sst_y_pred) == np.array(sst_y_true))
+
+        # Evaluate paraphrase detection.
+        para_y_true = []
+        para_y_pred = []
+        para_sent_ids = []
+        for step, batch in enumerate(tqdm(paraphrase_dataloader, desc=f'eval', disable=TQDM_DISABLE)):
+            (b_ids, b_tt, b_mask,
+             b_labels, b_sent_ids) = (batch['token_ids'], batch['token_type_ids'],
+                          batch['attention_mask'], batch['labels'], batch['sent_ids'])
+
+            b_ids = b_ids.to(device)
+            b_tt = b_tt.to(device)
+            b_mask = b_mask.to(device)
+
+            logits = model.predict_paraphrase(b_ids, b_mask, b_tt)
+            y_hat = logits.sigmoid().round().flatten().cpu().numpy()
+            b_labels = b_labels.flatten().cpu().numpy()
+
+            para_y_pred.extend(y_hat)
+            para_y_true.extend(b_labels)
+            para_sent_ids.extend(b_sent_ids)
+
+        paraphrase_accuracy = np.mean(np.array(para_y_pred) == np.array(para_y_true))
+
+        # Evaluate semantic textual similarity.
+        sts_y_true = []
+        sts_y_pred = []
+        sts_sent_ids = []
+        for step, batch in enumerate(tqdm(sts_dataloader, desc=f'eval', disable=TQDM_DISABLE)):
+            (b_ids, b_tt, b_mask,
+             b_labels, b_sent_ids) = (batch['token_ids'], batch['token_type_ids'],
+                          batch['attention_mask'], batch['labels'], batch['sent_ids'])
+
+            b_ids = b_ids.to(device)
+            b_tt = b_tt.to(device)
+            b_mask = b_mask.to(device)
+
+            logits = model.predict_similarity(b_ids, b_mask, b_tt)
+            y_hat = logits.flatten().cpu().numpy()
+            b_labels = b_labels.flatten().cpu().numpy()
+
+            sts_y_pred.extend(y_hat)
+            sts_y_true.extend(b_labels)
+            sts_sent_ids.extend(b_sent_ids)
+        pearson_mat = np.corrcoef(sts_y_pred,sts_y_true)
+        sts_corr = pearson_mat[1][0]
+
+        print(f'Sentiment classification accuracy: {sentiment_accuracy:.3f}')
+        print(f'Paraphrase detection accuracy: {paraphrase_accuracy:.3f}')
+        print(f'Semantic Textual Similarity correlation: {sts_corr:.3f}')
+
+        return (sentiment_accuracy,sst_y_pred, sst_sent_ids,
+                paraphrase_accuracy, para_y_pred, para_sent_ids,
+                sts_corr, sts_y_pred, sts_sent_ids)
+
+
 # Evaluate multitask model on test sets.
 def model_eval_test_multitask(sentiment_dataloader,
                          paraphrase_dataloader,
@@ -203,3 +288,68 @@ def model_eval_test_multitask(sentiment_dataloader,
         return (sst_y_pred, sst_sent_ids,
                 para_y_pred, para_sent_ids,
                 sts_y_pred, sts_sent_ids)
+
+
+# Evaluate multitask model on test sets when the pair dataloaders use joint
+# tokenization (SentencePairTestDataset with joint=True).
+def model_eval_test_multitask_joint(sentiment_dataloader,
+                                    paraphrase_dataloader,
+                                    sts_dataloader,
+                                    model, device):
+    model.eval()  # Switch to eval model, will turn off randomness like dropout.
+
+    with torch.no_grad():
+        # Evaluate sentiment classification.
+        sst_y_pred = []
+        sst_sent_ids = []
+        for step, batch in enumerate(tqdm(sentiment_dataloader, desc=f'eval', disable=TQDM_DISABLE)):
+            b_ids, b_mask, b_sent_ids = batch['token_ids'], batch['attention_mask'],  batch['sent_ids']
+
+            b_ids = b_ids.to(device)
+            b_mask = b_mask.to(device)
+
+            logits = model.predict_sentiment(b_ids, b_mask)
+            y_hat = logits.argmax(dim=-1).flatten().cpu().numpy()
+
+            sst_y_pred.extend(y_hat)
+            sst_sent_ids.extend(b_sent_ids)
+
+        # Evaluate paraphrase detection.
+        para_y_pred = []
+        para_sent_ids = []
+        for step, batch in enumerate(tqdm(paraphrase_dataloader, desc=f'eval', disable=TQDM_DISABLE)):
+            (b_ids, b_tt, b_mask,
+             b_sent_ids) = (batch['token_ids'], batch['token_type_ids'],
+                          batch['attention_mask'], batch['sent_ids'])
+
+            b_ids = b_ids.to(device)
+            b_tt = b_tt.to(device)
+            b_mask = b_mask.to(device)
+
+            logits = model.predict_paraphrase(b_ids, b_mask, b_tt)
+            y_hat = logits.sigmoid().round().flatten().cpu().numpy()
+
+            para_y_pred.extend(y_hat)
+            para_sent_ids.extend(b_sent_ids)
+
+        # Evaluate semantic textual similarity.
+        sts_y_pred = []
+        sts_sent_ids = []
+        for step, batch in enumerate(tqdm(sts_dataloader, desc=f'eval', disable=TQDM_DISABLE)):
+            (b_ids, b_tt, b_mask,
+             b_sent_ids) = (batch['token_ids'], batch['token_type_ids'],
+                          batch['attention_mask'], batch['sent_ids'])
+
+            b_ids = b_ids.to(device)
+            b_tt = b_tt.to(device)
+            b_mask = b_mask.to(device)
+
+            logits = model.predict_similarity(b_ids, b_mask, b_tt)
+            y_hat = logits.flatten().cpu().numpy()
+
+            sts_y_pred.extend(y_hat)
+            sts_sent_ids.extend(b_sent_ids)
+
+        return (sst_y_pred, sst_sent_ids,
+                para_y_pred, para_sent_ids,
+                sts_y_pred, sts_sent_ids)
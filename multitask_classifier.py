@@ -66,7 +66,7 @@ class MultitaskBERT(nn.Module):
     def __init__(self, config):
         super(MultitaskBERT, self).__init__()
         self.bert = BertModel.from_pretrained('bert-base-uncased')
-        self.tokenizer = BertTokenizer.from_pretrained('bert-large-uncased')
+        self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
         # Pretrain mode does not require updating BERT paramters.
         for param in self.bert.parameters():
             if config.option == 'pretrain':
@@ -84,6 +84,10 @@ class MultitaskBERT(nn.Module):
         self.ps_dropout_1 = nn.Dropout(config.hidden_dropout_prob)
         self.ps_dropout_2 = nn.Dropout(config.hidden_dropout_prob)
         self.ps_relu = nn.ReLU()
+        # The [SEP] id used by get_pair_embeddings; a (non-persistent) buffer so it
+        # moves with the model instead of being rebuilt on the GPU every step.
+        self.register_buffer('sep_id', torch.tensor([self.tokenizer.sep_token_id], dtype=torch.long),
+                             persistent=False)
 
 
     def forward(self, input_ids, attention_mask):
@@ -110,10 +114,12 @@ class MultitaskBERT(nn.Module):
     def get_pair_embeddings(self, input_ids_1, attention_mask_1,
                            input_ids_2, attention_mask_2):
         '''Given a batch of pairs of sentences, get the embeddings.'''
-        sep_token_id = torch.tensor([self.tokenizer.sep_token_id], dtype=torch.long, device=input_ids_1.device)
-        batch_sep_token_id = sep_token_id.repeat(input_ids_1.shape[0], 1)
+        # expand is a zero-copy view of the buffer; torch.cat materializes the
+        # bytes it needs, so no per-step [B,1] allocations happen here.
+        batch_sep_token_id = self.sep_id.view(1, 1).expand(input_ids_1.shape[0], 1)
+        sep_mask = torch.ones_like(batch_sep_token_id)
         input_id = torch.cat((input_ids_1, batch_sep_token_id, input_ids_2, batch_sep_token_id), dim=1)
-        attention_mask = torch.cat((attention_mask_1, torch.ones_like(batch_sep_token_id), attention_mask_2, torch.ones_like(batch_sep_token_id)), dim=1)                  
+        attention_mask = torch.cat((attention_mask_1, sep_mask, attention_mask_2, sep_mask), dim=1)
         x = self.forward(input_id, attention_mask)
 
         return x